@@ -0,0 +1,72 @@
+import search as Search
+import cache as Cache
+from helpers import *
+from limits import *
+
+# External
+from typing import Callable
+import chess
+
+
+class Analyser:
+    """
+    In-process analysis, this keeps a single Search and its
+    transposition table alive across calls so consecutive positions
+    can reuse previous results. Nothing is written to stdout.
+    With a cache path, finished analyses are also kept on disk.
+    """
+
+    def __init__(self, cachePath: str | None = None) -> None:
+        self.board = chess.Board()
+        self.search = Search.Search(self.board)
+
+        if cachePath is not None:
+            self.search.cache = Cache.AnalysisCache(cachePath)
+
+    def setBoard(self, board: chess.Board) -> None:
+        # Replay the game from its root so the repetition history is correct,
+        # the callers board is never modified.
+        self.board = board.root()
+        self.search.board = self.board
+
+        for move in board.move_stack:
+            self.board.push(move)
+            self.search.hashHistory.append(self.search.getHash())
+
+    # Fraction of the analyses answered or seeded by the cache
+    def hitRate(self) -> float:
+        if self.search.cache is None:
+            return 0.0
+
+        return self.search.cache.hitRate()
+
+    def analyse(
+        self,
+        board: chess.Board,
+        limits: Limits,
+        callback: Callable[[Search.SearchInfo], None] | None = None,
+    ) -> Search.SearchResult:
+        self.search.reset()
+        self.setBoard(board)
+        self.search.limit = limits
+
+        return self.search.iterativeDeepening(callback)
+
+
+_analyser: Analyser | None = None
+
+
+def analyse(
+    board: chess.Board,
+    limits: Limits,
+    callback: Callable[[Search.SearchInfo], None] | None = None,
+) -> Search.SearchResult:
+    """
+    Analyse a position with the shared module level Analyser.
+    """
+    global _analyser
+
+    if _analyser is None:
+        _analyser = Analyser()
+
+    return _analyser.analyse(board, limits, callback)
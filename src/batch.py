@@ -0,0 +1,203 @@
+import analysis
+from helpers import *
+from limits import *
+
+# External
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Iterator, TextIO
+import chess
+import chess.pgn
+
+# Every worker process has its own Analyser, so its own Search and TT
+_analyser: analysis.Analyser | None = None
+
+
+def initWorker() -> None:
+    global _analyser
+    _analyser = analysis.Analyser()
+
+
+def analysePosition(
+    index: int, id: str | None, board: chess.Board, limits: Limits
+) -> str:
+    result = _analyser.analyse(board, limits)
+
+    record = {"index": index}
+    if id is not None:
+        record["id"] = id
+    record["fen"] = board.fen()
+    record["bestmove"] = str(result.bestmove)
+    record["depth"] = result.depth
+
+    if result.score >= VALUE_MATE_IN_PLY or result.score <= VALUE_MATED_IN_PLY:
+        record["mate"] = int(_analyser.search.convert_score(result.score).split()[1])
+    else:
+        record["cp"] = result.score
+
+    record["pv"] = [str(move) for move in result.pv]
+    record["nodes"] = result.nodes
+    record["nps"] = result.nps
+    record["time"] = result.time
+
+    return json.dumps(record)
+
+
+# Yield every position of an EPD file, one per line
+def readEpd(file: TextIO) -> Iterator[tuple[str | None, chess.Board]]:
+    for line in file:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        board, ops = chess.Board.from_epd(line)
+        yield ops.get("id"), board
+
+
+# Yield every position of the mainline of every game in a PGN file,
+# the boards keep their move stack so repetitions are detected.
+def readPgn(file: TextIO) -> Iterator[tuple[str | None, chess.Board]]:
+    games = 0
+
+    while True:
+        game = chess.pgn.read_game(file)
+        if game is None:
+            break
+
+        games += 1
+        board = game.board()
+
+        for ply, move in enumerate(game.mainline_moves()):
+            board.push(move)
+            yield f"{games}:{ply + 1}", board.copy()
+
+
+def readPositions(path: str) -> Iterator[tuple[str | None, chess.Board]]:
+    with open(path) as file:
+        if path.endswith(".pgn"):
+            yield from readPgn(file)
+        else:
+            yield from readEpd(file)
+
+
+# Index of the position after the last complete result of a previous
+# output file, a partially written last line is cut off. The file is read
+# backwards from its end, so only the last record is ever loaded.
+def resumeIndex(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, "rb+") as file:
+        pos = file.seek(0, os.SEEK_END)
+        tail = b""
+
+        # Read blocks until the newline ending the last complete line
+        # and the newline before it are found.
+        while pos > 0:
+            size = min(4096, pos)
+            pos -= size
+            file.seek(pos)
+            tail = file.read(size) + tail
+
+            end = tail.rfind(b"\n")
+            if end != -1 and tail.rfind(b"\n", 0, end) != -1:
+                break
+
+        end = tail.rfind(b"\n")
+        file.truncate(pos + end + 1)
+
+    if end == -1:
+        return 0
+
+    last = tail[tail.rfind(b"\n", 0, end) + 1 : end]
+    return json.loads(last)["index"] + 1
+
+
+def run(
+    input: str,
+    output: str,
+    limits: Limits,
+    workers: int,
+    skip: int = 0,
+    resume: bool = False,
+) -> None:
+    if resume:
+        skip = max(skip, resumeIndex(output))
+
+    positions = readPositions(input)
+    done = 0
+    t0 = time.perf_counter()
+
+    with open(output, "a" if resume else "w") as out, Pool(
+        workers, initializer=initWorker
+    ) as pool:
+        # Keep a bounded number of positions in flight, so memory stays
+        # constant and results are written in input order.
+        pending: collections.deque = collections.deque()
+
+        def write(line: str) -> None:
+            nonlocal done
+            out.write(line + "\n")
+            out.flush()
+            done += 1
+
+            if done % 100 == 0:
+                report(done, t0)
+
+        for index, (id, board) in enumerate(positions):
+            if index < skip:
+                continue
+
+            pending.append(
+                pool.apply_async(analysePosition, (index, id, board, limits))
+            )
+
+            if len(pending) >= workers * 4:
+                write(pending.popleft().get())
+
+        while pending:
+            write(pending.popleft().get())
+
+    report(done, t0)
+
+
+def report(done: int, t0: float) -> None:
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    sys.stderr.write(
+        f"{done} positions {elapsed:.1f}s {done / elapsed:.2f} positions/s\n"
+    )
+    sys.stderr.flush()
+
+
+# python batch.py positions.epd results.jsonl --depth 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyse the positions of an EPD or PGN file into JSONL"
+    )
+    parser.add_argument("input", help="EPD file, or PGN file with a .pgn extension")
+    parser.add_argument("output", help="JSONL file the results are written to")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--nodes", type=int, default=0)
+    parser.add_argument("--movetime", type=int, default=0, help="in milliseconds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--skip", type=int, default=0, help="positions to skip")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue after the results already in the output file",
+    )
+    args = parser.parse_args()
+
+    run(
+        args.input,
+        args.output,
+        Limits(args.nodes, args.depth, args.movetime),
+        args.workers,
+        args.skip,
+        args.resume,
+    )
@@ -0,0 +1,146 @@
+import search as Search
+import uci as UCI
+from helpers import *
+from limits import *
+
+# External
+import random
+import sys
+import time
+import tracemalloc
+import chess
+
+# Positions searched by the bench, quiet enough that the qsearch
+# doesnt explode at low depths.
+BENCH_FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 w - - 0 10",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+def bench(depth: int) -> None:
+    search = Search.Search(chess.Board())
+    nodes = 0
+    t0 = time.perf_counter()
+
+    for fen in BENCH_FENS:
+        search.reset()
+        search.board.set_fen(fen)
+        search.limit = Limits(0, depth, 0)
+        result = search.iterativeDeepening()
+        nodes += search.nodes
+        print(fen, "nodes", search.nodes, "bestmove", result.bestmove)
+
+    elapsed = time.perf_counter() - t0
+    print("nodes", nodes, "nps", int(nodes / elapsed))
+
+
+class AllocSearch(Search.Search):
+    """
+    Takes a tracemalloc snapshot at the first qsearch node of the last
+    iteration and stops the search, at that point every ply of the
+    current line is active.
+    """
+
+    def __init__(self, board: chess.Board, depth: int) -> None:
+        super().__init__(board)
+        self.depth = depth
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.snapshotPly = 0
+        self.peak = 0
+
+    def qsearch(self, alpha: int, beta: int, ply: int) -> int:
+        if tracemalloc.is_tracing() and ply >= self.depth:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshotPly = ply
+            self.stop = True
+
+        return super().qsearch(alpha, beta, ply)
+
+
+# Memory allocated in search.py which is alive at the deepest node of the
+# line the search is on, and the peak of all traced memory up to that node.
+# Only allocations made since the search started are traced.
+def allocations(depth: int) -> None:
+    files = [tracemalloc.Filter(True, "*/search.py")]
+
+    for fen in BENCH_FENS:
+        search = AllocSearch(chess.Board(fen), depth)
+
+        # Warm up, so buffers which are reused by the search already exist
+        search.limit = Limits(0, depth, 0)
+        search.iterativeDeepening()
+
+        search.reset()
+        search.limit = Limits(0, depth, 0)
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        search.iterativeDeepening()
+        tracemalloc.stop()
+
+        if search.snapshot is None:
+            continue
+
+        stats = search.snapshot.filter_traces(files).statistics("filename")
+        blocks = sum(stat.count for stat in stats)
+        size = sum(stat.size for stat in stats)
+        ply = max(1, search.snapshotPly)
+        print(
+            fen,
+            "ply",
+            ply,
+            "live search.py blocks",
+            blocks,
+            f"({blocks / ply:.1f}/ply)",
+            "bytes",
+            size,
+            "peak KiB",
+            search.peak // 1024,
+        )
+
+
+# Latency of the position command during a game, once when every command
+# extends the previous one and once when it is rebuilt from scratch.
+def position(plies: int) -> None:
+    random.seed(0)
+    board = chess.Board()
+    moves = []
+
+    while len(moves) < plies and not board.is_game_over():
+        move = random.choice(list(board.legal_moves))
+        board.push(move)
+        moves.append(str(move))
+
+    uciLoop = UCI.UCI()
+    print("plies", "incremental ms", "full ms")
+
+    for ply in range(1, len(moves) + 1):
+        command = "position startpos moves " + " ".join(moves[:ply])
+
+        t0 = time.perf_counter()
+        uciLoop.processCommand(command)
+        incremental = time.perf_counter() - t0
+
+        if ply % 25 == 0:
+            uciLoop.processCommand("ucinewgame")
+            t0 = time.perf_counter()
+            uciLoop.processCommand(command)
+            full = time.perf_counter() - t0
+            print(ply, round(incremental * 1000, 3), round(full * 1000, 3))
+
+
+# python bench.py [depth] [alloc]
+# python bench.py [plies] position
+if __name__ == "__main__":
+    numbers = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+
+    if "alloc" in sys.argv:
+        allocations(numbers[0] if numbers else 4)
+    elif "position" in sys.argv:
+        position(numbers[0] if numbers else 200)
+    else:
+        bench(numbers[0] if numbers else 4)
@@ -0,0 +1,144 @@
+import tt as TT
+
+# External
+import sqlite3
+from dataclasses import dataclass
+import chess
+import chess.polyglot
+
+"""
+Persistent cache of finished analyses, shared between runs.
+Entries are keyed by the zobrist hash of the position and verified
+with its EPD, so hash collisions never return a wrong result.
+Repetitions and the fifty move rule make a result depend on more than the EPD,
+so the halfmove clock and the earlier positions a repetition can reach
+are verified as well.
+"""
+
+
+@dataclass
+class CacheEntry:
+    depth: int
+    score: int
+    bound: TT.Flag
+    pv: list[chess.Move]
+
+
+class AnalysisCache:
+    def __init__(self, path: str, maxEntries: int = 1_000_000) -> None:
+        # The search runs in its own thread, accesses are never concurrent
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key INTEGER PRIMARY KEY, epd TEXT NOT NULL, depth INTEGER NOT NULL,"
+            "score INTEGER NOT NULL, bound INTEGER NOT NULL, pv TEXT NOT NULL,"
+            "used INTEGER NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used)")
+        self.db.commit()
+
+        self.maxEntries = maxEntries
+        self.size = self.db.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+        self.clock = (
+            self.db.execute("SELECT MAX(used) FROM analysis").fetchone()[0] or 0
+        )
+
+        self.probes = 0
+        self.hits = 0
+
+    # SQLite integers are signed 64 bit
+    def key(self, board: chess.Board) -> int:
+        key = chess.polyglot.zobrist_hash(board)
+        return key - 2**64 if key >= 2**63 else key
+
+    # The EPD extended by the halfmove clock and the keys of the positions
+    # since the last capture or pawn move, older ones can never repeat.
+    def state(self, board: chess.Board, history: list[int]) -> str:
+        reachable = history[max(0, len(history) - board.halfmove_clock) :]
+        return (
+            board.epd()
+            + " "
+            + str(board.halfmove_clock)
+            + "".join(" " + format(key, "x") for key in reachable)
+        )
+
+    def probe(self, board: chess.Board, history: list[int]) -> CacheEntry | None:
+        self.probes += 1
+        key = self.key(board)
+
+        row = self.db.execute(
+            "SELECT epd, depth, score, bound, pv FROM analysis WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None or row[0] != self.state(board, history):
+            return None
+
+        self.hits += 1
+        self.clock += 1
+        self.db.execute("UPDATE analysis SET used = ? WHERE key = ?", (self.clock, key))
+        self.db.commit()
+
+        return CacheEntry(
+            depth=row[1],
+            score=row[2],
+            bound=TT.Flag(row[3]),
+            pv=[chess.Move.from_uci(move) for move in row[4].split()],
+        )
+
+    # Store a result, a deeper analysis of the same position is kept
+    def store(
+        self,
+        board: chess.Board,
+        history: list[int],
+        depth: int,
+        score: int,
+        bound: TT.Flag,
+        pv: list[chess.Move],
+    ) -> None:
+        key = self.key(board)
+        epd = self.state(board, history)
+
+        row = self.db.execute(
+            "SELECT epd, depth FROM analysis WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is not None and row[0] == epd and row[1] > depth:
+            return
+
+        if row is None:
+            self.size += 1
+
+        self.clock += 1
+        self.db.execute(
+            "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                epd,
+                depth,
+                score,
+                bound.value,
+                " ".join(str(move) for move in pv),
+                self.clock,
+            ),
+        )
+
+        if self.size > self.maxEntries:
+            self.evict()
+
+        self.db.commit()
+
+    # Remove the least recently used tenth of the entries
+    def evict(self) -> None:
+        target = self.maxEntries - self.maxEntries // 10
+        self.db.execute(
+            "DELETE FROM analysis WHERE key IN "
+            "(SELECT key FROM analysis ORDER BY used LIMIT ?)",
+            (self.size - target,),
+        )
+        self.size = target
+
+    def hitRate(self) -> float:
+        return self.hits / self.probes if self.probes else 0.0
+
+    def close(self) -> None:
+        self.db.close()
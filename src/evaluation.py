@@ -24,8 +24,9 @@ class Evaluation:
             material += piece_values[piece]
 
             # add piece square table value
+            # the tables are from whites point of view, mirror the square for black
             psqt += (
-                list(reversed(psqt_values[piece]))[square]
+                psqt_values[piece][63 - square]
                 if color == chess.BLACK
                 else psqt_values[piece][square]
             )
@@ -1,4 +1,5 @@
 MAX_PLY = 60
+MAX_MOVES = 256
 CHECK_RATE = 256
 
 VALUE_INFINITE = 32001
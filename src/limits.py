@@ -1,8 +1,12 @@
 class Limits:
+    __slots__ = ("nodes", "depth", "time")
+
     def __init__(
         self,
         nodes: int,
         depth: int,
         time: int,
     ) -> None:
-        self.limited = {"nodes": nodes, "depth": depth, "time": time}
+        self.nodes = nodes
+        self.depth = depth
+        self.time = time
@@ -5,7 +5,12 @@ def main() -> None:
     uciLoop = uci.UCI()
 
     while True:
-        command = input()
+        try:
+            command = input()
+        except EOFError:
+            # stdin was closed, e.g. by a GUI which exited
+            command = "quit"
+
         uciLoop.processCommand(command)
 
         if command == "quit":
@@ -0,0 +1,375 @@
+from helpers import *
+
+# External
+import argparse
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+import chess
+
+"""
+Plays games between two engines over UCI to validate changes.
+Every opening is played twice with reversed colours and the results are
+reported as Elo together with a live SPRT verdict.
+Games are either played at a fixed number of nodes, which measures
+search efficiency, or with a time control, which also measures speed.
+"""
+
+# Score reported for a mate, large enough to adjudicate immediately
+MATE_SCORE = 30_000
+
+
+class Engine:
+    def __init__(self, command: str) -> None:
+        self.process = subprocess.Popen(
+            shlex.split(command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.send("uci")
+        self.readUntil("uciok")
+
+    def send(self, command: str) -> None:
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+
+    def readUntil(self, prefix: str) -> list[str]:
+        lines = []
+
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError("engine terminated")
+
+            line = line.strip()
+            lines.append(line)
+
+            if line.startswith(prefix):
+                return lines
+
+    def newGame(self) -> None:
+        self.send("ucinewgame")
+        self.send("isready")
+        self.readUntil("readyok")
+
+    # Returns the bestmove and the last reported score from the engines point of view
+    def go(self, position: str, go: str) -> tuple[str, int | None]:
+        self.send(position)
+        self.send(go)
+        lines = self.readUntil("bestmove")
+
+        score = None
+        for line in lines:
+            tokens = line.split()
+            if tokens and tokens[0] == "info" and "score" in tokens:
+                kind = tokens[tokens.index("score") + 1]
+                value = int(tokens[tokens.index("score") + 2])
+
+                if kind == "cp":
+                    score = value
+                else:
+                    score = MATE_SCORE if value > 0 else -MATE_SCORE
+
+        return lines[-1].split()[1], score
+
+    def quit(self) -> None:
+        self.send("quit")
+        self.process.wait()
+
+
+class Settings:
+    def __init__(
+        self,
+        nodes: int,
+        tc: float,
+        inc: float,
+        adjudicateScore: int,
+        adjudicateMoves: int,
+        drawScore: int,
+        drawMoves: int,
+        drawAfter: int,
+        maxPlies: int,
+    ) -> None:
+        self.nodes = nodes
+        self.tc = tc
+        self.inc = inc
+        self.adjudicateScore = adjudicateScore
+        self.adjudicateMoves = adjudicateMoves
+        self.drawScore = drawScore
+        self.drawMoves = drawMoves
+        self.drawAfter = drawAfter
+        self.maxPlies = maxPlies
+
+
+# The engines of a worker process, started once and reused for every game
+_engines: list[Engine] = []
+
+
+def initWorker(commands: list[str]) -> None:
+    global _engines
+    _engines = [Engine(command) for command in commands]
+
+
+# Play one game, returns the score of the first engine
+def playGame(fen: str, firstIsWhite: bool, settings: Settings) -> float:
+    board = chess.Board(fen)
+    startTurn = board.turn
+    engines = (
+        _engines if firstIsWhite == (board.turn == chess.WHITE) else _engines[::-1]
+    )
+    for engine in engines:
+        engine.newGame()
+
+    # Milliseconds left on the clock, indexed by engine to move
+    clocks = [settings.tc * 1000, settings.tc * 1000]
+    scores: list[list[int]] = [[], []]
+    moves: list[str] = []
+    result = None
+
+    while result is None:
+        side = len(moves) & 1
+        engine = engines[side]
+        position = "position fen " + fen
+        if moves:
+            position += " moves " + " ".join(moves)
+
+        if settings.nodes:
+            go = "go nodes " + str(settings.nodes)
+        else:
+            us, them = ("w", "b") if board.turn == chess.WHITE else ("b", "w")
+            go = (
+                f"go {us}time {int(clocks[side])} {them}time {int(clocks[side ^ 1])}"
+                f" {us}inc {int(settings.inc * 1000)} {them}inc {int(settings.inc * 1000)}"
+            )
+
+        t0 = time.perf_counter()
+        move, score = engine.go(position, go)
+        clocks[side] -= (time.perf_counter() - t0) * 1000
+
+        if not settings.nodes:
+            if clocks[side] < 0:
+                result = -1 if side == 0 else 1
+                break
+            clocks[side] += settings.inc * 1000
+
+        board.push_uci(move)
+        moves.append(move)
+        scores[side].append(score if score is not None else 0)
+
+        if board.is_game_over(claim_draw=True):
+            outcome = board.outcome(claim_draw=True)
+            if outcome.winner is None:
+                result = 0
+            else:
+                result = 1 if outcome.winner == startTurn else -1
+            break
+
+        result = adjudicate(scores, settings)
+
+        if result is None and len(moves) >= settings.maxPlies:
+            result = 0
+
+    # result is from the view of engines[0], convert it to the first engine
+    if engines is not _engines:
+        result = -result
+
+    return (result + 1) / 2
+
+
+# Adjudicate when both engines agree on the score for enough moves,
+# returns the result from the view of the engine which moved first.
+def adjudicate(scores: list[list[int]], settings: Settings) -> int | None:
+    n = settings.adjudicateMoves
+    if n and len(scores[0]) >= n and len(scores[1]) >= n:
+        first = scores[0][-n:]
+        second = scores[1][-n:]
+
+        if all(s >= settings.adjudicateScore for s in first) and all(
+            s <= -settings.adjudicateScore for s in second
+        ):
+            return 1
+
+        if all(s <= -settings.adjudicateScore for s in first) and all(
+            s >= settings.adjudicateScore for s in second
+        ):
+            return -1
+
+    n = settings.drawMoves
+    if n and len(scores[0]) + len(scores[1]) >= settings.drawAfter:
+        if all(abs(s) <= settings.drawScore for s in scores[0][-n:] + scores[1][-n:]):
+            return 0
+
+    return None
+
+
+# Elo difference and its 95% error margin from the game results
+def elo(wins: int, draws: int, losses: int) -> tuple[float, float]:
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    if score <= 0 or score >= 1:
+        return math.copysign(math.inf, score - 0.5), math.inf
+
+    variance = (
+        wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score**2
+    ) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def toElo(s: float) -> float:
+        s = min(max(s, 1e-9), 1 - 1e-9)
+        return -400 * math.log10(1 / s - 1)
+
+    return toElo(score), (toElo(score + margin) - toElo(score - margin)) / 2
+
+
+# Log likelihood ratio of the hypotheses elo1 against elo0,
+# using the normal approximation of the score distribution.
+def llr(wins: int, draws: int, losses: int, elo0: float, elo1: float) -> float:
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (
+        wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score**2
+    ) / games
+
+    # Only identical results so far, nothing can be said about the spread
+    if variance == 0:
+        return 0.0
+
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+
+    return games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+
+def readOpenings(path: str | None) -> list[str]:
+    if path is None:
+        # Fixed node games from a single position are all identical
+        sys.stderr.write(
+            "warning: no --openings given, every game starts from the start position\n"
+        )
+        return [chess.STARTING_FEN]
+
+    openings = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                board, _ = chess.Board.from_epd(line)
+                openings.append(board.fen())
+
+    return openings
+
+
+def run(
+    commands: list[str],
+    openings: list[str],
+    games: int,
+    settings: Settings,
+    workers: int,
+    elo0: float,
+    elo1: float,
+    alpha: float,
+    beta: float,
+) -> None:
+    lower = math.log(beta / (1 - alpha))
+    upper = math.log((1 - beta) / alpha)
+
+    # Every opening is played with both colours
+    tasks = [
+        (openings[(i // 2) % len(openings)], i % 2 == 0, settings) for i in range(games)
+    ]
+
+    wins = draws = losses = 0
+
+    with Pool(workers, initializer=initWorker, initargs=(commands,)) as pool:
+        for result in pool.imap_unordered(playGameTask, tasks):
+            if result == 1:
+                wins += 1
+            elif result == 0:
+                losses += 1
+            else:
+                draws += 1
+
+            diff, margin = elo(wins, draws, losses)
+            ratio = llr(wins, draws, losses, elo0, elo1)
+            print(
+                f"Games {wins + draws + losses} W {wins} L {losses} D {draws}"
+                f" Elo {diff:.1f} +/- {margin:.1f}"
+                f" LLR {ratio:.2f} [{lower:.2f}, {upper:.2f}]",
+                flush=True,
+            )
+
+            if ratio >= upper:
+                print("SPRT: H1 accepted", flush=True)
+                pool.terminate()
+                return
+
+            if ratio <= lower:
+                print("SPRT: H0 accepted", flush=True)
+                pool.terminate()
+                return
+
+    print("SPRT: inconclusive", flush=True)
+
+
+def playGameTask(task: tuple[str, bool, Settings]) -> float:
+    return playGame(*task)
+
+
+# python match.py --engine1 "python new/src/main.py" --engine2 "python old/src/main.py"
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    default = shlex.join([sys.executable, os.path.join(here, "main.py")])
+
+    parser = argparse.ArgumentParser(description="Play a match between two engines")
+    parser.add_argument("--engine1", default=default, help="command of the new engine")
+    parser.add_argument("--engine2", default=default, help="command of the base engine")
+    parser.add_argument("--openings", help="EPD file with the opening positions")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--nodes", type=int, default=0, help="fixed nodes per move")
+    parser.add_argument(
+        "--tc", default="10+0.1", help="seconds+increment, used without --nodes"
+    )
+    parser.add_argument("--adjudicate-score", type=int, default=1000)
+    parser.add_argument("--adjudicate-moves", type=int, default=4)
+    parser.add_argument("--draw-score", type=int, default=10)
+    parser.add_argument("--draw-moves", type=int, default=8)
+    parser.add_argument(
+        "--draw-after", type=int, default=80, help="plies before draws are adjudicated"
+    )
+    parser.add_argument("--max-plies", type=int, default=300)
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=10.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tc, _, inc = args.tc.partition("+")
+
+    run(
+        [args.engine1, args.engine2],
+        readOpenings(args.openings),
+        args.games,
+        Settings(
+            args.nodes,
+            float(tc),
+            float(inc or 0),
+            args.adjudicate_score,
+            args.adjudicate_moves,
+            args.draw_score,
+            args.draw_moves,
+            args.draw_after,
+            args.max_plies,
+        ),
+        args.workers,
+        args.elo0,
+        args.elo1,
+        args.alpha,
+        args.beta,
+    )
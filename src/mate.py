@@ -0,0 +1,263 @@
+import search as Search
+from helpers import *
+from limits import *
+
+# External
+import sys
+import time
+from typing import Callable
+import chess
+import chess.polyglot
+
+"""
+Mate Search, this is a special search which only answers if the side
+to move can force a mate in N moves. Unlike absearch it never evaluates
+a position, the attacker needs one move which mates against every
+defence and the defender needs one reply which escapes.
+"""
+
+
+class MateSearch:
+    def __init__(self, board: chess.Board, checksOnly: bool = False) -> None:
+        self.board = board
+
+        # Only search checking moves for the attacker, this is a lot faster
+        # but mates starting with a quiet move are not found.
+        self.checksOnly = checksOnly
+
+        # Proof table, key -> (smallest n a mate was proven for, mating move)
+        self.proven: dict[int, tuple[int, chess.Move]] = {}
+        # key -> largest n for which the mate was refuted
+        self.disproven: dict[int, int] = {}
+
+        # Last defence which refuted a mate, indexed by n
+        self.refutations = [chess.Move.null()] * (MAX_PLY + 1)
+
+        self.nodes = 0
+        self.stop = False
+
+    def attack(self, n: int) -> bool:
+        """
+        True if the side to move mates in at most n moves.
+        """
+        if self.stop:
+            return False
+
+        key = chess.polyglot.zobrist_hash(self.board)
+
+        proof = self.proven.get(key)
+        if proof is not None and proof[0] <= n:
+            return True
+
+        if self.disproven.get(key, 0) >= n:
+            return False
+
+        self.nodes += 1
+
+        for move in self.attackerMoves(n):
+            self.board.push(move)
+            mates = self.defend(n)
+            self.board.pop()
+
+            if mates:
+                self.proven[key] = (n, move)
+                return True
+
+        if not self.stop:
+            self.disproven[key] = n
+
+        return False
+
+    def defend(self, n: int) -> bool:
+        """
+        True if every defence loses against a mate in the remaining n - 1 moves.
+        """
+        self.nodes += 1
+
+        replies = list(self.board.legal_moves)
+
+        # Checkmate or stalemate
+        if not replies:
+            return self.board.is_check()
+
+        if n == 1:
+            return False
+
+        # Try the defence which refuted the last attempt first
+        refutation = self.refutations[n]
+        if refutation in replies:
+            replies.remove(refutation)
+            replies.insert(0, refutation)
+
+        for reply in replies:
+            self.board.push(reply)
+            mated = self.attack(n - 1)
+            self.board.pop()
+
+            if not mated:
+                self.refutations[n] = reply
+                return False
+
+        return True
+
+    # The last move of a mate has to give check, otherwise order the
+    # checks first and captures second, they are most likely to mate.
+    def attackerMoves(self, n: int) -> list[chess.Move]:
+        checks = []
+        captures = []
+        quiets = []
+
+        for move in self.board.legal_moves:
+            if self.board.gives_check(move):
+                checks.append(move)
+            elif n > 1 and not self.checksOnly:
+                if self.board.is_capture(move):
+                    captures.append(move)
+                else:
+                    quiets.append(move)
+
+        return checks + captures + quiets
+
+    # Move to play when no mate was found, checks and captures are
+    # ordered first. The null move is only returned without legal moves.
+    def bestAttempt(self) -> chess.Move:
+        for move in self.attackerMoves(2):
+            return move
+
+        return next(iter(self.board.legal_moves), chess.Move.null())
+
+    # Build the PV of a proven mate, the defender plays the longest defence
+    def getPV(self, n: int) -> list[chess.Move]:
+        pv = []
+
+        while n > 0:
+            proof = self.proven.get(chess.polyglot.zobrist_hash(self.board))
+            if proof is None:
+                break
+
+            move = proof[1]
+            self.board.push(move)
+            pv.append(move)
+
+            longest = None
+            for reply in self.board.legal_moves:
+                self.board.push(reply)
+                replyProof = self.proven.get(chess.polyglot.zobrist_hash(self.board))
+                self.board.pop()
+
+                if replyProof is not None and (
+                    longest is None or replyProof[0] > longest[0]
+                ):
+                    longest = (replyProof[0], reply)
+
+            if longest is None:
+                break
+
+            self.board.push(longest[1])
+            pv.append(longest[1])
+            n = longest[0]
+
+        for _ in pv:
+            self.board.pop()
+
+        return pv
+
+    def search(
+        self, maxMoves: int, callback: Callable[[Search.SearchInfo], None] | None = None
+    ) -> Search.SearchResult:
+        """
+        Search for the shortest mate in at most maxMoves moves.
+        The bestmove of the result is the null move if no mate was found.
+        """
+        self.nodes = 0
+        t0 = time.time_ns()
+        result = Search.SearchResult(chess.Move.null())
+
+        for n in range(1, min(maxMoves, MAX_PLY // 2) + 1):
+            found = self.attack(n)
+
+            if self.stop:
+                break
+
+            if found:
+                elapsed = time.time_ns() - t0
+                time_in_seconds = max(1, elapsed / 1_000_000_000)
+                pv = self.getPV(n)
+                info = Search.SearchInfo(
+                    depth=2 * n - 1,
+                    score=mate_in(2 * n - 1),
+                    pv=pv,
+                    nodes=self.nodes,
+                    nps=int(self.nodes / time_in_seconds),
+                    time=round(elapsed / 1_000_000),
+                )
+
+                if callback is not None:
+                    callback(info)
+
+                result.bestmove = pv[0]
+                result.depth = info.depth
+                result.score = info.score
+                result.pv = pv
+                result.nodes = info.nodes
+                result.nps = info.nps
+                result.time = info.time
+                result.infos.append(info)
+                break
+
+        return result
+
+
+# Solve the puzzles of an EPD file, the length of the mate is given with the dm opcode
+# python mate.py mates.epd [checks] [compare]
+def bench(path: str, checksOnly: bool, compare: bool) -> None:
+    solved = 0
+    total = 0
+    mateTime = 0.0
+    searchTime = 0.0
+
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            board, ops = chess.Board.from_epd(line)
+            moves = int(ops["dm"])
+            total += 1
+
+            t0 = time.perf_counter()
+            result = MateSearch(board, checksOnly).search(moves)
+            elapsed = time.perf_counter() - t0
+            mateTime += elapsed
+
+            ok = result.score == mate_in(2 * moves - 1)
+            solved += ok
+            line = (
+                f"{ops.get('id', board.fen())}: mate {moves}"
+                f" {'ok' if ok else 'FAILED'} {result.bestmove}"
+                f" nodes {result.nodes} {elapsed * 1000:.0f}ms"
+            )
+
+            if compare:
+                search = Search.Search(board)
+                search.limit = Limits(0, 2 * moves - 1, 0)
+                t0 = time.perf_counter()
+                search.iterativeDeepening()
+                elapsed = time.perf_counter() - t0
+                searchTime += elapsed
+                line += f" | absearch nodes {search.nodes} {elapsed * 1000:.0f}ms"
+
+            print(line, flush=True)
+
+    print(f"solved {solved}/{total} in {mateTime:.2f}s")
+    if compare:
+        print(f"absearch {searchTime:.2f}s")
+
+
+if __name__ == "__main__":
+    bench(
+        sys.argv[1] if len(sys.argv) > 1 else "mates.epd",
+        "checks" in sys.argv,
+        "compare" in sys.argv,
+    )
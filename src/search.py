@@ -2,13 +2,91 @@ import time
 import tt as TT
 import evaluation as Eval
 import psqt as PQST
+import cache as Cache
 
 # External
 import chess
 import chess.polyglot
 from helpers import *
 from limits import *
-from sys import stdout
+from dataclasses import dataclass, field
+from typing import Callable
+
+
+@dataclass
+class SearchInfo:
+    """
+    Result of one completed iteration of the iterative deepening loop.
+    """
+
+    depth: int
+    score: int
+    pv: list[chess.Move]
+    nodes: int
+    nps: int
+    time: int  # in milliseconds
+
+
+@dataclass
+class SearchResult:
+    """
+    Final result of a search, the last completed iteration
+    and the bestmove to play.
+    """
+
+    bestmove: chess.Move
+    depth: int = 0
+    score: int = -VALUE_INFINITE
+    pv: list[chess.Move] = field(default_factory=list)
+    nodes: int = 0
+    nps: int = 0
+    time: int = 0
+    infos: list[SearchInfo] = field(default_factory=list)
+
+
+# Shared null move, so we dont have to create a new one every node
+NULL_MOVE = chess.Move.null()
+
+# Most Valuable Victim - Least Valuable Aggressor
+# Indexed by [victim][attacker]
+MVVLVA: list[list[int]] = [
+    [0, 0, 0, 0, 0, 0, 0],
+    [0, 105, 104, 103, 102, 101, 100],
+    [0, 205, 204, 203, 202, 201, 200],
+    [0, 305, 304, 303, 302, 301, 300],
+    [0, 405, 404, 403, 402, 401, 400],
+    [0, 505, 504, 503, 502, 501, 500],
+    [0, 605, 604, 603, 602, 601, 600],
+]
+
+
+class Stack:
+    """
+    A frame of the search stack, there is one for every ply.
+    The frames are allocated once and reused by every node
+    searched at that ply, this avoids creating new lists
+    for every node.
+    """
+
+    __slots__ = ("moves", "scores", "pv", "pvLength", "key", "nullMove", "killers")
+
+    def __init__(self) -> None:
+        # Moves of this node and their move ordering scores
+        self.moves = [NULL_MOVE] * MAX_MOVES
+        self.scores = [0] * MAX_MOVES
+
+        # Principal variation starting at this ply
+        self.pv = [NULL_MOVE] * (MAX_PLY + 1)
+        self.pvLength = 0
+
+        # Zobrist hash of the node, used for repetition detection
+        self.key = 0
+
+        # True while the null move of this node is searched
+        self.nullMove = False
+
+        # Quiet moves which caused a beta cutoff at this ply
+        self.killers = [NULL_MOVE, NULL_MOVE]
 
 
 class Search:
@@ -21,11 +99,11 @@ class Search:
         # allows to skip parts of the search tree and order moves.
         self.transposition_table = TT.TranspositionTable()
 
-        self.pvLength = [0] * MAX_PLY
-        # This is our principal variation table, it stores the best
-        # moves for each depth. It is used to print the best line
+        # This is our search stack, every ply has its own frame which
+        # holds the moves, the principal variation and killers of that ply.
+        # The principal variation of the root frame is printed
         # after the search is completed.
-        self.pvTable = [[chess.Move.null()] * MAX_PLY for _ in range(MAX_PLY)]
+        self.stack = [Stack() for _ in range(MAX_PLY + 1)]
 
         # Total nodes searched
         self.nodes = 0
@@ -47,6 +125,9 @@ class Search:
         # Indexed by [color][from][to]
         self.htable = [[[0 for x in range(64)] for y in range(64)] for z in range(2)]
 
+        # Optional persistent cache of finished analyses
+        self.cache: Cache.AnalysisCache | None = None
+
     def qsearch(self, alpha: int, beta: int, ply: int) -> int:
         """
         Quiescence Search, this is a special search that only searches
@@ -69,16 +150,22 @@ class Search:
         if bestValue > alpha:
             alpha = bestValue
 
-        # Sort the moves, the highest score should come first,
+        # Score the moves, the highest score should be searched first,
         # to reduce the size of the search tree
-        moves = sorted(
-            self.board.generate_legal_captures(),
-            key=lambda move: self.scoreQMove(move),
-            reverse=True,
-        )
+        frame = self.stack[ply]
+        moves = frame.moves
+        scores = frame.scores
+        moveCount = 0
+        for move in self.board.generate_legal_captures():
+            moves[moveCount] = move
+            scores[moveCount] = self.scoreQMove(move)
+            moveCount += 1
 
         # Loop over all legal captures
-        for move in moves:
+        i = 0
+        while i < moveCount:
+            move = self.pickMove(frame, i, moveCount)
+            i += 1
             self.nodes += 1
 
             captured = self.board.piece_type_at(move.to_square)
@@ -124,12 +211,14 @@ class Search:
         if ply >= MAX_PLY:
             return Eval.Evaluation.evaluate(self.board)
 
-        self.pvLength[ply] = ply
+        frame = self.stack[ply]
+        frame.pvLength = ply
         RootNode = ply == 0
         hashKey = self.getHash()
+        frame.key = hashKey
 
         if not RootNode:
-            if self.isRepetition(hashKey):
+            if self.isRepetition(hashKey, ply):
                 # slight draw bias
                 return -5
 
@@ -149,7 +238,7 @@ class Search:
         # Transposition Table probing
         tte = self.transposition_table.probeEntry(hashKey)
         ttHit = hashKey == tte.key
-        ttMove = tte.move if ttHit else chess.Move.null()
+        ttMove = tte.move if ttHit else NULL_MOVE
 
         # Adjust score
         ttScore = (
@@ -171,11 +260,13 @@ class Search:
 
         # Null move pruning
         if depth >= 3 and not inCheck:
-            self.board.push(chess.Move.null())
+            self.board.push(NULL_MOVE)
+            frame.nullMove = True
 
             score = -self.absearch(-beta, -beta + 1, depth - 2, ply + 1)
 
             self.board.pop()
+            frame.nullMove = False
 
             if score >= beta:
                 if score >= VALUE_TB_WIN_IN_MAX_PLY:
@@ -185,51 +276,61 @@ class Search:
 
         oldAlpha = alpha
         bestScore = -VALUE_INFINITE
-        bestMove = chess.Move.null()
+        bestMove = NULL_MOVE
         madeMoves = 0
 
-        # Sort the moves, the highest score should come first
+        # Score the moves, the highest score should be searched first
         # The ttMove should be first one searched, incase we have a hit
-        moves = sorted(
-            self.board.legal_moves,
-            key=lambda move: self.scoreMove(move, ttMove),
-            reverse=True,
-        )
-
-        for move in moves:
+        moves = frame.moves
+        scores = frame.scores
+        moveCount = 0
+        for move in self.board.legal_moves:
+            moves[moveCount] = move
+            scores[moveCount] = self.scoreMove(move, ttMove, frame)
+            moveCount += 1
+
+        while madeMoves < moveCount:
+            move = self.pickMove(frame, madeMoves, moveCount)
             madeMoves += 1
             self.nodes += 1
 
             # Make move
             self.board.push(move)
-            self.hashHistory.append(hashKey)
 
             # Search
             score = -self.absearch(-beta, -alpha, depth - 1, ply + 1)
 
             # Unmake move
             self.board.pop()
-            self.hashHistory.pop()
 
             if score > bestScore:
                 bestScore = score
                 bestMove = move
 
                 # update PV
-                self.pvTable[ply][ply] = move
+                child = self.stack[ply + 1]
+                frame.pv[ply] = move
 
-                for i in range(ply + 1, self.pvLength[ply + 1]):
-                    self.pvTable[ply][i] = self.pvTable[ply + 1][i]
+                # copy the PV of the child without creating a temporary list
+                i = ply + 1
+                while i < child.pvLength:
+                    frame.pv[i] = child.pv[i]
+                    i += 1
 
-                self.pvLength[ply] = self.pvLength[ply + 1]
+                frame.pvLength = child.pvLength
 
                 if score > alpha:
                     # update alpha!
                     alpha = score
 
                     if score >= beta:
-                        # update history
+                        # update killers and history
                         if not self.board.is_capture(move):
+                            killers = frame.killers
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+
                             bonus = depth * depth
                             hhBonus = (
                                 bonus
@@ -273,22 +374,35 @@ class Search:
 
         return bestScore
 
-    def iterativeDeepening(self) -> None:
+    def iterativeDeepening(
+        self, callback: Callable[[SearchInfo], None] | None = None
+    ) -> SearchResult:
         """
         Iterative Deepening, this will call the absearch function
         with increasing depth until the time limit is reached or
         the maximum depth is reached.
+        The callback is invoked with the info of every completed depth.
         """
         self.nodes = 0
 
-        score = -VALUE_INFINITE
-        bestmove = chess.Move.null()
+        result = SearchResult(NULL_MOVE)
 
         # Start measuring time
         self.t0 = time.time_ns()
 
+        # Return a previous analysis which is deep enough,
+        # otherwise use its PV to order the moves of the search
+        if self.cache is not None:
+            entry = self.cache.probe(self.board, self.hashHistory)
+
+            if entry is not None and entry.pv:
+                if entry.depth >= self.limit.depth:
+                    return self.cachedResult(entry, callback)
+
+                self.seedPV(entry.pv)
+
         # Iterative Deepening Loop
-        for d in range(1, self.limit.limited["depth"] + 1):
+        for d in range(1, self.limit.depth + 1):
             score = self.absearch(-VALUE_INFINITE, VALUE_INFINITE, d, 0)
 
             # Dont use completed depths result
@@ -296,30 +410,106 @@ class Search:
                 break
 
             # Save bestmove
-            bestmove = self.pvTable[0][0]
+            result.bestmove = self.stack[0].pv[0]
+
+            info = self.stats(d, score, time.time_ns() - self.t0)
+            result.infos.append(info)
 
-            # print info
-            now = time.time_ns()
-            stdout.write(self.stats(d, score, now - self.t0) + "\n")
-            stdout.flush()
+            if callback is not None:
+                callback(info)
 
         # last attempt to get a bestmove
-        if bestmove == chess.Move.null():
-            bestmove = self.pvTable[0][0]
+        if result.bestmove == NULL_MOVE:
+            result.bestmove = self.stack[0].pv[0]
+
+        if result.infos:
+            last = result.infos[-1]
+            result.depth = last.depth
+            result.score = last.score
+            result.pv = last.pv
+            result.nodes = last.nodes
+            result.nps = last.nps
+            result.time = last.time
+
+            if self.cache is not None:
+                self.cache.store(
+                    self.board,
+                    self.hashHistory,
+                    result.depth,
+                    result.score,
+                    TT.Flag.EXACTBOUND,
+                    result.pv,
+                )
+
+        return result
+
+    def cachedResult(
+        self, entry: Cache.CacheEntry, callback: Callable[[SearchInfo], None] | None
+    ) -> SearchResult:
+        info = SearchInfo(
+            depth=entry.depth, score=entry.score, pv=entry.pv, nodes=0, nps=0, time=0
+        )
+
+        if callback is not None:
+            callback(info)
 
-        # print bestmove, as per UCI Protocol
-        stdout.write("bestmove " + str(bestmove) + "\n")
-        stdout.flush()
+        return SearchResult(
+            bestmove=entry.pv[0],
+            depth=entry.depth,
+            score=entry.score,
+            pv=entry.pv,
+            infos=[info],
+        )
+
+    # Store the moves of a PV in the TT, so they are searched first
+    def seedPV(self, pv: list[chess.Move]) -> None:
+        played = 0
+
+        for ply, move in enumerate(pv):
+            if not self.board.is_legal(move):
+                break
+
+            self.transposition_table.storeEntry(
+                self.getHash(), 0, TT.Flag.NONEBOUND, VALUE_NONE, move, ply
+            )
+            self.board.push(move)
+            played += 1
+
+        for _ in range(played):
+            self.board.pop()
 
     # Detect a repetition
-    def isRepetition(self, key: int, draw: int = 1) -> bool:
+    # The keys of the nodes above us are kept in the search stack,
+    # nodes which were left with a null move are skipped.
+    # Afterwards the game history is searched.
+    def isRepetition(self, key: int, ply: int, draw: int = 1) -> bool:
         count = 0
+        halfmoves = self.board.halfmove_clock
+        distance = 0
+
+        for i in range(ply - 1, -1, -1):
+            frame = self.stack[i]
+            if frame.nullMove:
+                continue
+
+            if distance >= halfmoves:
+                return False
+
+            if distance & 1 == 0 and frame.key == key:
+                count += 1
+                if count == draw:
+                    return True
+
+            distance += 1
+
         size = len(self.hashHistory)
 
-        for i in range(size - 1, -1, -2):
-            if i >= size - self.board.halfmove_clock:
-                if self.hashHistory[i] == key:
-                    count += 1
+        for i in range(size - 1 - (distance & 1), -1, -2):
+            if size - 1 - i + distance >= halfmoves:
+                break
+
+            if self.hashHistory[i] == key:
+                count += 1
                 if count == draw:
                     return True
 
@@ -327,39 +517,55 @@ class Search:
 
     # Most Valuable Victim - Least Valuable Aggressor
     def mvvlva(self, move: chess.Move) -> int:
-        mvvlva: list[list[int]] = [
-            [0, 0, 0, 0, 0, 0, 0],
-            [0, 105, 104, 103, 102, 101, 100],
-            [0, 205, 204, 203, 202, 201, 200],
-            [0, 305, 304, 303, 302, 301, 300],
-            [0, 405, 404, 403, 402, 401, 400],
-            [0, 505, 504, 503, 502, 501, 500],
-            [0, 605, 604, 603, 602, 601, 600],
-        ]
-
-        from_square = move.from_square
-        to_square = move.to_square
-        attacker = self.board.piece_type_at(from_square)
-        victim = self.board.piece_type_at(to_square)
+        attacker = self.board.piece_type_at(move.from_square)
+        victim = self.board.piece_type_at(move.to_square)
 
         # En passant
         if victim is None:
             victim = 1
-        return mvvlva[victim][attacker]
+        return MVVLVA[victim][attacker]
 
     # assign a score to moves in qsearch
     def scoreQMove(self, move: chess.Move) -> int:
         return self.mvvlva(move)
 
     # assign a score to normal moves
-    def scoreMove(self, move: chess.Move, ttMove: chess.Move) -> int:
+    def scoreMove(self, move: chess.Move, ttMove: chess.Move, frame: Stack) -> int:
         if move == ttMove:
             return 1_000_000
         elif self.board.is_capture(move):
             # make sure captures are ordered higher than quiets
             return 32_000 + self.mvvlva(move)
+        elif move == frame.killers[0]:
+            return 31_000
+        elif move == frame.killers[1]:
+            return 30_000
         return self.htable[self.board.turn][move.from_square][move.to_square]
 
+    # Select the best scored move of the remaining ones and move it to index i,
+    # usually a cutoff happens early and we dont have to sort all moves.
+    def pickMove(self, frame: Stack, i: int, moveCount: int) -> chess.Move:
+        moves = frame.moves
+        scores = frame.scores
+        best = i
+        bestScore = scores[i]
+
+        # the first of equal scores is kept
+        j = i + 1
+        while j < moveCount:
+            if scores[j] > bestScore:
+                best = j
+                bestScore = scores[j]
+            j += 1
+
+        # move it to the front, keeping the order of the others
+        # so moves with equal scores are searched in generation order
+        if best != i:
+            moves.insert(i, moves.pop(best))
+            scores.insert(i, scores.pop(best))
+
+        return moves[i]
+
     def getHash(self) -> int:
         return chess.polyglot.zobrist_hash(self.board)
 
@@ -367,10 +573,9 @@ class Search:
         if self.stop:
             return True
 
-        if (
-            self.limit.limited["nodes"] != 0
-            and self.nodes >= self.limit.limited["nodes"]
-        ):
+        limit = self.limit
+
+        if limit.nodes != 0 and self.nodes >= limit.nodes:
             return True
 
         if self.checks > 0 and not iter:
@@ -379,23 +584,21 @@ class Search:
 
         self.checks = CHECK_RATE
 
-        if self.limit.limited["time"] == 0:
+        if limit.time == 0:
             return False
 
         timeNow = time.time_ns()
-        if (timeNow - self.t0) / 1_000_000 > self.limit.limited["time"]:
+        if (timeNow - self.t0) / 1_000_000 > limit.time:
+            # remember it, the next calls would skip the time check
+            self.stop = True
             return True
 
         return False
 
     # Build PV
-    def getPV(self) -> str:
-        pv = ""
-
-        for i in range(0, self.pvLength[0]):
-            pv += " " + str(self.pvTable[0][i])
-
-        return pv
+    def getPV(self) -> list[chess.Move]:
+        root = self.stack[0]
+        return root.pv[: root.pvLength]
 
     # Convert mate scores
     def convert_score(self, score: int) -> str:
@@ -410,34 +613,37 @@ class Search:
         else:
             return "cp " + str(score)
 
-    # Print UCI Info
-    def stats(self, depth: int, score: int, time: int) -> str:
+    # Collect the info of a completed depth
+    def stats(self, depth: int, score: int, time: int) -> SearchInfo:
         time_in_ms = int(time / 1_000_000)
         time_in_seconds = max(1, time_in_ms / 1_000)
-        info = (
-            "info depth "
-            + str(depth)
-            + " score "
-            + str(self.convert_score(score))
-            + " nodes "
-            + str(self.nodes)
-            + " nps "
-            + str(int(self.nodes / time_in_seconds))
-            + " time "
-            + str(round(time / 1_000_000))
-            + " pv"
-            + self.getPV()
+        return SearchInfo(
+            depth=depth,
+            score=score,
+            pv=self.getPV(),
+            nodes=self.nodes,
+            nps=int(self.nodes / time_in_seconds),
+            time=round(time / 1_000_000),
         )
-        return info
 
-    # Reset search stuff
-    def reset(self) -> None:
-        self.pvLength[0] = 0
+    # Reset the state of a single search, the tables and
+    # the hash history of the game are kept
+    def resetSearch(self) -> None:
+        self.stack[0].pvLength = 0
         self.nodes = 0
         self.t0 = 0
         self.stop = False
         self.checks = CHECK_RATE
+
+    # Reset search stuff
+    def reset(self) -> None:
+        self.resetSearch()
         self.hashHistory = []
+
+        for frame in self.stack:
+            frame.killers[0] = NULL_MOVE
+            frame.killers[1] = NULL_MOVE
+
         self.htable = [[[0 for x in range(64)] for y in range(64)] for z in range(2)]
 
 
@@ -446,6 +652,7 @@ if __name__ == "__main__":
     board = chess.Board()
     search = Search(board)
 
-    search.limit.limited["depth"] = 6
+    search.limit.depth = 6
 
-    search.iterativeDeepening()
+    result = search.iterativeDeepening(print)
+    print(result.bestmove)
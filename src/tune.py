@@ -0,0 +1,297 @@
+import psqt as PSQT
+
+# External
+import argparse
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool
+import chess
+import numpy as np
+
+"""
+Texel tuning of the piece values and PSQT.
+The evaluation is linear in its parameters, so every position is reduced once
+to the material difference per piece type and the list of PSQT entries it uses.
+The loss and its gradient are then computed for the whole dataset at once with NumPy.
+"""
+
+PIECE_TYPES = [
+    chess.PAWN,
+    chess.KNIGHT,
+    chess.BISHOP,
+    chess.ROOK,
+    chess.QUEEN,
+    chess.KING,
+]
+
+# Columns of the PSQT features, white pieces use [0, 384)
+# and black pieces the mirrored square in [384, 768).
+PSQT_SIZE = len(PIECE_TYPES) * 64
+
+RESULT_REGEX = re.compile(r"1/2-1/2|1-0|0-1|\[(?:1\.0|0\.5|0\.0)\]")
+RESULTS = {
+    "1-0": 1.0,
+    "0-1": 0.0,
+    "1/2-1/2": 0.5,
+    "[1.0]": 1.0,
+    "[0.5]": 0.5,
+    "[0.0]": 0.0,
+}
+
+CHUNK_SIZE = 16384
+
+
+# Extract the features of a chunk of labelled EPD lines,
+# only the piece placement and the result are needed.
+def extractChunk(lines: list[str]) -> tuple[np.ndarray, ...]:
+    counts = np.zeros((len(lines), len(PIECE_TYPES)), dtype=np.int8)
+    lengths = np.zeros(len(lines), dtype=np.int64)
+    results = np.zeros(len(lines), dtype=np.float32)
+    cols: list[int] = []
+    n = 0
+
+    for line in lines:
+        match = RESULT_REGEX.search(line)
+        if match is None:
+            continue
+
+        results[n] = RESULTS[match.group(0)]
+        start = len(cols)
+        rank = 7
+        file = 0
+
+        for c in line.split(" ", 1)[0]:
+            if c == "/":
+                rank -= 1
+                file = 0
+            elif c.isdigit():
+                file += int(c)
+            else:
+                piece = chess.Piece.from_symbol(c)
+                square = rank * 8 + file
+                index = piece.piece_type - 1
+
+                if piece.color == chess.WHITE:
+                    counts[n, index] += 1
+                    cols.append(index * 64 + square)
+                else:
+                    counts[n, index] -= 1
+                    cols.append(PSQT_SIZE + index * 64 + 63 - square)
+
+                file += 1
+
+        lengths[n] = len(cols) - start
+        n += 1
+
+    return (
+        counts[:n],
+        lengths[:n],
+        np.array(cols, dtype=np.int16),
+        results[:n],
+    )
+
+
+def readChunks(path: str):
+    with open(path) as file:
+        chunk = []
+
+        for line in file:
+            chunk.append(line)
+
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+# Extract the features of the dataset, or load them from the cache
+def loadDataset(path: str, cache: str, workers: int) -> dict[str, np.ndarray]:
+    # np.savez appends the suffix itself, the check has to use the same path
+    if not cache.endswith(".npz"):
+        cache += ".npz"
+
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        with np.load(cache) as data:
+            return dict(data)
+
+    counts, lengths, cols, results = [], [], [], []
+
+    with Pool(workers) as pool:
+        for chunk in pool.imap(extractChunk, readChunks(path)):
+            counts.append(chunk[0])
+            lengths.append(chunk[1])
+            cols.append(chunk[2])
+            results.append(chunk[3])
+
+    dataset = {
+        "counts": np.concatenate(counts),
+        "lengths": np.concatenate(lengths),
+        "cols": np.concatenate(cols),
+        "results": np.concatenate(results),
+    }
+    np.savez(cache, **dataset)
+
+    return dataset
+
+
+class Tuner:
+    def __init__(self, dataset: dict[str, np.ndarray]) -> None:
+        self.counts = dataset["counts"].astype(np.float64)
+        self.cols = dataset["cols"].astype(np.int64)
+        self.rows = np.repeat(
+            np.arange(len(dataset["lengths"]), dtype=np.int32), dataset["lengths"]
+        )
+        self.results = dataset["results"].astype(np.float64)
+        self.size = len(self.results)
+
+        # Start from the current tables
+        self.values = np.array(
+            [PSQT.piece_values[pt] for pt in PIECE_TYPES], dtype=np.float64
+        )
+        self.psqt = np.array(
+            [PSQT.psqt_values[pt] for pt in PIECE_TYPES], dtype=np.float64
+        ).reshape(-1)
+
+        self.K = 1.0
+
+    # Evaluation of every position from whites point of view
+    def evaluate(self, values: np.ndarray, psqt: np.ndarray) -> np.ndarray:
+        weights = np.concatenate((psqt, -psqt))[self.cols]
+        return self.counts @ values + np.bincount(
+            self.rows, weights=weights, minlength=self.size
+        )
+
+    def sigmoid(self, evals: np.ndarray, K: float) -> np.ndarray:
+        return 1.0 / (1.0 + np.power(10.0, -K * evals / 400.0))
+
+    def loss(self, evals: np.ndarray, K: float) -> float:
+        return float(np.mean((self.results - self.sigmoid(evals, K)) ** 2))
+
+    # Find the scaling constant K which fits the current evaluation best
+    def fitK(self) -> float:
+        evals = self.evaluate(self.values, self.psqt)
+        low, high = 0.0, 4.0
+
+        # golden section search
+        ratio = (5**0.5 - 1) / 2
+        for _ in range(40):
+            a = high - ratio * (high - low)
+            b = low + ratio * (high - low)
+            if self.loss(evals, a) < self.loss(evals, b):
+                high = b
+            else:
+                low = a
+
+        self.K = (low + high) / 2
+        return self.K
+
+    def gradient(self, evals: np.ndarray) -> tuple[np.ndarray, np.ndarray, float]:
+        s = self.sigmoid(evals, self.K)
+        loss = float(np.mean((self.results - s) ** 2))
+
+        # derivative of the loss with respect to the evaluation
+        d = 2.0 * (s - self.results) * s * (1.0 - s) * self.K * np.log(10) / 400.0
+        d /= self.size
+
+        gradValues = d @ self.counts
+        gradPsqt = np.bincount(self.cols, weights=d[self.rows], minlength=2 * PSQT_SIZE)
+        gradPsqt = gradPsqt[:PSQT_SIZE] - gradPsqt[PSQT_SIZE:]
+
+        return gradValues, gradPsqt, loss
+
+    # Adam, the king value is not tuned since it always cancels out
+    def tune(self, epochs: int, lr: float) -> None:
+        params = np.concatenate((self.values, self.psqt))
+        m = np.zeros_like(params)
+        v = np.zeros_like(params)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        kingValue = len(PIECE_TYPES) - 1
+        t0 = time.perf_counter()
+
+        for epoch in range(1, epochs + 1):
+            values = params[: len(PIECE_TYPES)]
+            psqt = params[len(PIECE_TYPES) :]
+
+            gradValues, gradPsqt, loss = self.gradient(self.evaluate(values, psqt))
+            grad = np.concatenate((gradValues, gradPsqt))
+            grad[kingValue] = 0.0
+
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad * grad
+            mHat = m / (1 - beta1**epoch)
+            vHat = v / (1 - beta2**epoch)
+            params -= lr * mHat / (np.sqrt(vHat) + eps)
+
+            if epoch % 10 == 0 or epoch == epochs:
+                sys.stderr.write(
+                    f"epoch {epoch} loss {loss:.6f} {time.perf_counter() - t0:.1f}s\n"
+                )
+                sys.stderr.flush()
+
+        self.values = params[: len(PIECE_TYPES)]
+        self.psqt = params[len(PIECE_TYPES) :]
+
+
+# Regenerate psqt.py with the tuned values
+def writePsqt(path: str, values: np.ndarray, psqt: np.ndarray) -> None:
+    names = ["PAWN", "KNIGHT", "BISHOP", "ROOK", "QUEEN", "KING"]
+    tables = np.rint(psqt).astype(int).reshape(len(PIECE_TYPES), 64)
+
+    lines = ["import chess", "", "# fmt: off", "piece_values = {", "    None: 0,"]
+    for name, value in zip(names, np.rint(values).astype(int)):
+        lines.append(f"    chess.{name}: {value},")
+    lines.append("}")
+    lines.append("")
+    lines.append('"""')
+    lines.append("These PSQT were fitted with tune.py, starting from")
+    lines.append("https://www.chessprogramming.org/Simplified_Evaluation_Function")
+    lines.append('"""')
+    lines.append("psqt_values = {")
+
+    for name, table in zip(names, tables):
+        lines.append(f"    chess.{name}: [")
+        rows = [", ".join(str(x) for x in table[r * 8 : r * 8 + 8]) for r in range(8)]
+        lines.append(",\n".join("    " + row for row in rows))
+        lines.append("    ],")
+
+    lines.append("}")
+    lines.append("")
+    lines.append("# fmt: on")
+
+    with open(path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+# python tune.py dataset.epd --epochs 500
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tune the piece values and PSQT on a labelled EPD dataset"
+    )
+    parser.add_argument(
+        "dataset", help='EPD/FEN lines labelled with c9 "1-0" or [1.0] style results'
+    )
+    parser.add_argument("--cache", help="feature cache, defaults to <dataset>.npz")
+    parser.add_argument("--output", default="psqt.py")
+    parser.add_argument("--epochs", type=int, default=500)
+    parser.add_argument("--lr", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    dataset = loadDataset(
+        args.dataset, args.cache or args.dataset + ".npz", args.workers
+    )
+    tuner = Tuner(dataset)
+    sys.stderr.write(
+        f"{tuner.size} positions loaded in {time.perf_counter() - t0:.1f}s\n"
+    )
+
+    K = tuner.fitK()
+    sys.stderr.write(f"K {K:.4f}\n")
+
+    tuner.tune(args.epochs, args.lr)
+    writePsqt(args.output, tuner.values, tuner.psqt)
@@ -1,5 +1,7 @@
 import search as Search
 import evaluation as Eval
+import cache as Cache
+import mate as Mate
 from helpers import *
 from limits import *
 
@@ -14,14 +16,21 @@ class UCI:
         self.out = stdout
         self.board = chess.Board()
         self.search = Search.Search(self.board)
+        self.mateSearch: Mate.MateSearch | None = None
         self.thread: Thread | None = None
 
+        # The last position command, used to only apply new moves
+        self.positionFen: str | None = None
+        self.positionMoves: list[str] = []
+
     def output(self, s) -> None:
         self.out.write(str(s) + "\n")
         self.out.flush()
 
     def stop(self) -> None:
         self.search.stop = True
+        if self.mateSearch is not None:
+            self.mateSearch.stop = True
         if self.thread is not None:
             try:
                 self.thread.join()
@@ -30,6 +39,8 @@ class UCI:
 
     def quit(self) -> None:
         self.search.stop = True
+        if self.mateSearch is not None:
+            self.mateSearch.stop = True
         if self.thread is not None:
             try:
                 self.thread.join()
@@ -42,14 +53,110 @@ class UCI:
         self.output("")
         self.output("option name Move Overhead type spin default 5 min 0 max 5000")
         self.output("option name Ponder type check default false")
+        self.output("option name Analysis Cache type string default <empty>")
         self.output("uciok")
 
     def isready(self) -> None:
         self.output("readyok")
 
+    def setoption(self, input: str) -> None:
+        name_idx = input.find("name ")
+        value_idx = input.find(" value ")
+        if name_idx < 0 or value_idx < 0:
+            return
+
+        name = input[name_idx + len("name ") : value_idx].strip()
+        value = input[value_idx + len(" value ") :].strip()
+
+        if name == "Analysis Cache":
+            if self.search.cache is not None:
+                self.search.cache.close()
+                self.search.cache = None
+
+            if value and value != "<empty>":
+                self.search.cache = Cache.AnalysisCache(value)
+
     def ucinewgame(self) -> None:
         pass
 
+    # Format the info of a completed depth as per UCI Protocol
+    def info(self, info: Search.SearchInfo) -> None:
+        self.output(
+            "info depth "
+            + str(info.depth)
+            + " score "
+            + self.search.convert_score(info.score)
+            + " nodes "
+            + str(info.nodes)
+            + " nps "
+            + str(info.nps)
+            + " time "
+            + str(info.time)
+            + " pv"
+            + "".join(" " + str(move) for move in info.pv)
+        )
+
+    def go(self) -> None:
+        result = self.search.iterativeDeepening(self.info)
+
+        if self.search.cache is not None:
+            self.output(
+                "info string analysis cache hit rate "
+                + str(round(self.search.cache.hitRate() * 100))
+                + "%"
+            )
+
+        self.output("bestmove " + str(result.bestmove))
+
+    def position(self, fen: str, movelist: list[str]) -> None:
+        played = len(self.positionMoves)
+
+        # During a game every position command usually extends the previous one,
+        # then only the new moves are played and the search tables stay warm.
+        if fen == self.positionFen and movelist[:played] == self.positionMoves:
+            self.search.resetSearch()
+            newMoves = movelist[played:]
+
+        # A takeback, undo the moves which are no longer part of the game
+        elif (
+            fen == self.positionFen and self.positionMoves[: len(movelist)] == movelist
+        ):
+            self.search.resetSearch()
+            for _ in range(played - len(movelist)):
+                self.board.pop()
+                self.search.hashHistory.pop()
+            newMoves = []
+
+        else:
+            self.search.reset()
+            self.board.set_fen(fen)
+            newMoves = movelist
+
+        # Only trust the board again once every move was played
+        self.positionFen = None
+
+        for move in newMoves:
+            self.board.push_uci(move)
+            self.search.hashHistory.append(self.search.getHash())
+
+        self.positionFen = fen
+        self.positionMoves = movelist
+
+    def goMate(self, mateSearch: Mate.MateSearch, moves: int) -> None:
+        result = mateSearch.search(moves, self.info)
+
+        if result.bestmove == chess.Move.null() and not mateSearch.stop:
+            # No mate, still play a legal move
+            self.output("info string no mate in " + str(moves) + " found")
+            self.search.limit = Limits(0, 1, 0)
+            result = self.search.iterativeDeepening()
+
+        # Stopped before a mate was found, the search is stopped as well
+        if result.bestmove == chess.Move.null():
+            result.bestmove = mateSearch.bestAttempt()
+
+        self.output("bestmove " + str(result.bestmove))
+
     def eval(self) -> None:
         eval = Eval.Evaluation()
         self.output(eval.evaluate(self.board))
@@ -62,17 +169,18 @@ class UCI:
             case "stop":
                 self.stop()
                 self.search.reset()
+                self.positionFen = None
             case "ucinewgame":
                 self.ucinewgame()
                 self.search.reset()
+                self.positionFen = None
             case "uci":
                 self.uci()
             case "isready":
                 self.isready()
             case "setoption":
-                pass
+                self.setoption(input)
             case "position":
-                self.search.reset()
                 fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
                 movelist = []
 
@@ -88,39 +196,41 @@ class UCI:
                     else:
                         fen = input[position_idx:]
 
-                self.board.set_fen(fen)
-                self.search.hashHistory.clear()
-
-                for move in movelist:
-                    self.board.push_uci(move)
-                    self.search.hashHistory.append(self.search.getHash())
+                self.position(fen.strip(), movelist)
 
             case "print":
                 print(self.board)
             case "go":
+                if "mate" in splitted:
+                    moves = int(splitted[splitted.index("mate") + 1])
+
+                    # Created before the thread starts, so a stop always reaches it
+                    self.mateSearch = Mate.MateSearch(self.board)
+                    self.thread = Thread(
+                        target=self.goMate, args=(self.mateSearch, moves)
+                    )
+                    self.thread.start()
+                    return
+
                 limits = Limits(0, MAX_PLY, 0)
 
                 l = ["depth", "nodes"]
                 for limit in l:
                     if limit in splitted:
-                        limits.limited[limit] = int(splitted[splitted.index(limit) + 1])
+                        setattr(limits, limit, int(splitted[splitted.index(limit) + 1]))
 
                 ourTimeStr = "wtime" if self.board.turn == chess.WHITE else "btime"
                 ourTimeIncStr = "winc" if self.board.turn == chess.WHITE else "binc"
 
                 if ourTimeStr in input:
-                    limits.limited["time"] = (
-                        int(splitted[splitted.index(ourTimeStr) + 1]) / 20
-                    )
+                    limits.time = int(splitted[splitted.index(ourTimeStr) + 1]) / 20
 
                 if ourTimeIncStr in input:
-                    limits.limited["time"] += (
-                        int(splitted[splitted.index(ourTimeIncStr) + 1]) / 2
-                    )
+                    limits.time += int(splitted[splitted.index(ourTimeIncStr) + 1]) / 2
 
                 self.search.limit = limits
 
-                self.thread = Thread(target=self.search.iterativeDeepening)
+                self.thread = Thread(target=self.go)
                 self.thread.start()
 
             case "eval":